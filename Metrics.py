@@ -1,5 +1,6 @@
+import threading
+
 import streamlit as st
-import pandas as pd
 import altair as alt
 import plotly.express as px
 
@@ -7,14 +8,53 @@ st.set_page_config(page_title="KG DEI", page_icon=":bar_chart:", layout="wide")
 
 from streamlit_gsheets import GSheetsConnection
 
+from employee_data import breakdown_options, labels, find_employee_key, refresh, states_match, sorted_options, aggregate_counts
+
+# Column that uniquely identifies an employee in the sheet, configured as `employee_key_column`
+# in .streamlit/secrets.toml. Without it every new read of the sheet is processed in full.
+employee_key_column = st.secrets.get("employee_key_column")
+
+# How long a read of the sheet is reused before it is downloaded again, in seconds
+sheet_ttl = 600
+
 # Create a connection object.
 conn = st.connection("gsheets", type=GSheetsConnection)
-df = conn.read()
 
-# Replace NaN values in the 'layer' column with "N-A" for display and filtering purposes
-df['layer'] = df['layer'].fillna("N-A")
+# The same read object is returned until it expires, so unchanged reruns skip the diff entirely
+@st.cache_resource(ttl=sheet_ttl)
+def read_sheet():
+    return conn.read(ttl=0)
+
+# Derived data and aggregates, shared by every session. Each refresh swaps in a new state under
+# the lock, so a session keeps a consistent state for the whole render without holding the lock.
+@st.cache_resource
+def shared_employee_data():
+    return {'lock': threading.Lock(), 'state': None}
+
+raw_df = read_sheet()
+employee_key = find_employee_key(raw_df, employee_key_column)
+shared = shared_employee_data()
+with shared['lock']:
+    state = shared['state'] = refresh(shared['state'], raw_df, employee_key)
 
 st.sidebar.header('KG DEI Dashboard')
+
+if employee_key is None:
+    st.sidebar.info("Incremental refresh is off: set `employee_key_column` in the app secrets "
+                    "to a column that uniquely identifies every employee.")
+
+# Full rebuild as a consistency check for the incrementally patched aggregates
+if st.sidebar.button("Rebuild from scratch"):
+    with shared['lock']:
+        patched = shared['state']
+        state = shared['state'] = refresh(patched, raw_df, employee_key, rebuild=True)
+    if states_match(patched, state):
+        st.sidebar.success("Incremental aggregates match a full rebuild.")
+    else:
+        st.sidebar.warning("Incremental aggregates were out of date and have been rebuilt.")
+
+df = state['df']
+
 st.sidebar.header('Metrics')
 
 # Page selection with a blank option
@@ -24,16 +64,15 @@ selected_page = st.sidebar.selectbox("Choose the Metrics you want to display:",
 st.sidebar.header('Breakdown Variable')
 
 # Add Breakdown Variable Selection
-breakdown_options = ['unit', 'subunit', 'layer']
 selected_breakdown = st.sidebar.selectbox("Breakdown Variable", breakdown_options)
 
 # Sidebar Widgets
 st.sidebar.header('Filters')
 
 # Unit, Subunit, and Layer Filters using multiselect without "All" option
-unit_options = df['unit'].unique().tolist()
-subunit_options = df['subunit'].unique().tolist() if 'subunit' in df.columns else []
-layer_options = df['layer'].unique().tolist() if 'layer' in df.columns else []
+unit_options = sorted_options(state, 'unit')
+subunit_options = sorted_options(state, 'subunit')
+layer_options = sorted_options(state, 'layer')
 
 # Multiselect filters for Unit, Subunit, and Layer
 selected_units = st.sidebar.multiselect("Select Unit(s)", unit_options)
@@ -41,10 +80,10 @@ selected_subunits = st.sidebar.multiselect("Select Subunit(s)", subunit_options)
 selected_layers = st.sidebar.multiselect("Select Layer(s)", layer_options)
 
 # Additional Filters for Gender, Generation, Religion, and Tenure
-gender_options = df['gender'].unique().tolist() if 'gender' in df.columns else []
-generation_options = df['generation'].unique().tolist() if 'generation' in df.columns else []
-religion_options = df['Religious Denomination Key'].unique().tolist() if 'Religious Denomination Key' in df.columns else []
-tenure_options = ['<1 Year', '1-3 Year', '4-6 Year', '6-10 Year', '11-15 Year', '16-20 Year', '20-25 Year', '>25 Year']
+gender_options = sorted_options(state, 'gender')
+generation_options = sorted_options(state, 'generation')
+religion_options = sorted_options(state, 'Religious Denomination Key')
+tenure_options = labels
 
 # Multiselect filters for Gender, Generation, Religion, and Tenure
 selected_genders = st.sidebar.multiselect("Select Gender(s)", gender_options)
@@ -79,14 +118,20 @@ if selected_generations and 'generation' in filtered_df.columns:
 if selected_religions and 'Religious Denomination Key' in filtered_df.columns:
     filtered_df = filtered_df[filtered_df['Religious Denomination Key'].isin(selected_religions)]
 
-# For tenure, categorize 'Years' column and filter based on selected tenure groups
-bins = [-1, 1, 3, 6, 10, 15, 20, 25, float('inf')]
-labels = ['<1 Year', '1-3 Year', '4-6 Year', '6-10 Year', '11-15 Year', '16-20 Year', '20-25 Year', '>25 Year']
-filtered_df['Service_Group'] = pd.cut(filtered_df['Years'], bins=bins, labels=labels, right=False)
-
+# For tenure, filter on the tenure groups derived from the 'Years' column
 if selected_tenures:
     filtered_df = filtered_df[filtered_df['Service_Group'].isin(selected_tenures)]
 
+filters_active = any([selected_units, selected_subunits, selected_layers, selected_genders,
+                      selected_generations, selected_religions, selected_tenures])
+
+# Count employees grouped by the given columns; the unfiltered view is served from the maintained aggregates
+def group_counts(by):
+    counts = None if filters_active else aggregate_counts(state, by)
+    if counts is None:
+        return filtered_df.groupby(by, observed=True).size()
+    return counts
+
 # Display total employee count
 def display_total_employees_with_breakdown():
     total_employees = len(filtered_df)
@@ -96,8 +141,7 @@ def display_total_employees_with_breakdown():
     
     # Group by the selected breakdown and count employees
     breakdown_counts = (
-        filtered_df.groupby(selected_breakdown)
-        .size()
+        group_counts([selected_breakdown])
         .reset_index(name="Count")
         .sort_values("Count", ascending=False)
     )
@@ -141,15 +185,8 @@ def display_total_employees_with_breakdown():
 
 # Function to display gender summary
 def display_gender_summary():
-    # Replace missing values in 'layer' column with "N-A"
-    df['layer'] = df['layer'].fillna("N-A")
-    filtered_df['layer'] = filtered_df['layer'].fillna("N-A")
-
-    # Select the correct DataFrame based on filters
-    display_df = filtered_df.copy()
-
     # Group by the selected breakdown variable and calculate gender distribution
-    gender_counts = display_df.groupby([selected_breakdown, 'gender']).size().unstack().fillna(0)
+    gender_counts = group_counts([selected_breakdown, 'gender']).unstack().fillna(0)
 
     # Ensure that 'Male' and 'Female' exist in the groupby result
     if 'Male' not in gender_counts.columns:
@@ -226,15 +263,8 @@ def display_gender_summary():
 
 # Function to display generation summary
 def display_generation_summary():
-    # Replace missing values in 'layer' column with "N-A"
-    df['layer'] = df['layer'].fillna("N-A")
-    filtered_df['layer'] = filtered_df['layer'].fillna("N-A")
-
-    # Select the correct DataFrame based on filters
-    display_df = filtered_df.copy()
-
     # Group by the selected breakdown and calculate generation distribution
-    generation_counts = display_df.groupby([selected_breakdown, 'generation']).size().unstack().fillna(0)
+    generation_counts = group_counts([selected_breakdown, 'generation']).unstack().fillna(0)
 
     # Define color map for generations
     color_map = {
@@ -334,15 +364,8 @@ def display_generation_summary():
 
 # Function to display religion summary
 def display_religion_summary():
-    # Replace missing values in 'layer' column with "N-A"
-    df['layer'] = df['layer'].fillna("N-A")
-    filtered_df['layer'] = filtered_df['layer'].fillna("N-A")
-
-    # Select the correct DataFrame based on filters
-    display_df = filtered_df.copy()
-
     # Calculate religion distribution by selected breakdown
-    religion_counts = display_df.groupby([selected_breakdown, 'Religious Denomination Key']).size().unstack().fillna(0)
+    religion_counts = group_counts([selected_breakdown, 'Religious Denomination Key']).unstack().fillna(0)
 
     # Define color map for religions
     color_map = {
@@ -433,20 +456,8 @@ def display_religion_summary():
 
 # Function to display tenure summary
 def display_tenure_summary():
-    # Replace missing values in 'layer' column with "N-A"
-    df['layer'] = df['layer'].fillna("N-A")
-    filtered_df['layer'] = filtered_df['layer'].fillna("N-A")
-
-    # Select the correct DataFrame based on filters
-    display_df = filtered_df.copy()
-
-    # Define tenure groups and categorize them
-    bins = [-1, 1, 3, 6, 10, 15, 20, 25, float('inf')]
-    labels = ['<1 Year', '1-3 Year', '4-6 Year', '6-10 Year', '11-15 Year', '16-20 Year', '20-25 Year', '>25 Year']
-    display_df['Service_Group'] = pd.cut(display_df['Years'], bins=bins, labels=labels, right=False)
-
     # Calculate tenure distribution by selected breakdown
-    tenure_counts = display_df.groupby([selected_breakdown, 'Service_Group']).size().unstack().fillna(0)
+    tenure_counts = group_counts([selected_breakdown, 'Service_Group']).unstack().fillna(0)
 
     # Define color map for tenure groups
     color_map = {
@@ -535,12 +546,9 @@ def display_region_summary():
         st.error("The 'region' column is not available in the dataset.")
         return
 
-    display_df = filtered_df.copy()
-
     # Group by region and count the employees
     region_counts = (
-        display_df.groupby("region")
-        .size()
+        group_counts(["region"])
         .reset_index(name="Count")
         .sort_values("Count", ascending=False)
     )
@@ -598,13 +606,9 @@ def display_age_summary():
         st.error("The 'Age' column is not available in the dataset.")
         return
 
-    # Filter the dataset
-    display_df = filtered_df.copy()
-
     # Count employees by individual age
     age_counts = (
-        display_df.groupby("Age")
-        .size()
+        group_counts(["Age"])
         .reset_index(name="Count")
         .sort_values("Age")
     )
@@ -0,0 +1,121 @@
+import pandas as pd
+
+# Tenure groups derived from the 'Years' column
+bins = [-1, 1, 3, 6, 10, 15, 20, 25, float('inf')]
+labels = ['<1 Year', '1-3 Year', '4-6 Year', '6-10 Year', '11-15 Year', '16-20 Year', '20-25 Year', '>25 Year']
+
+# Columns offered as sidebar filters, and the groupings whose employee counts are kept up to date
+breakdown_options = ['unit', 'subunit', 'layer']
+filter_columns = breakdown_options + ['gender', 'generation', 'Religious Denomination Key']
+aggregate_groups = (
+    [(breakdown,) for breakdown in breakdown_options]
+    + [('region',), ('Age',)]
+    + [(breakdown, metric) for breakdown in breakdown_options
+       for metric in ['gender', 'generation', 'Religious Denomination Key', 'Service_Group']]
+)
+
+# Return the configured key column if it uniquely identifies every employee, otherwise None
+def find_employee_key(data, column):
+    if column and column in data.columns and data[column].notna().all() and data[column].is_unique:
+        return column
+    return None
+
+# Add the derived columns to a set of rows read from the sheet
+def derive_rows(rows):
+    rows = rows.copy()
+    # Replace NaN values in the 'layer' column with "N-A" for display and filtering purposes
+    rows['layer'] = rows['layer'].fillna("N-A")
+    rows['Service_Group'] = pd.cut(rows['Years'], bins=bins, labels=labels, right=False)
+    return rows
+
+# Add (sign=1) or remove (sign=-1) the given derived rows from the filter options and count aggregates
+def update_counts(state, rows, sign):
+    def apply(counter, counts):
+        for value, count in counts.items():
+            total = counter.get(value, 0) + sign * int(count)
+            if total:
+                counter[value] = total
+            else:
+                counter.pop(value, None)
+
+    for column in filter_columns:
+        if column in rows.columns:
+            apply(state['options'].setdefault(column, {}), rows[column].value_counts())
+
+    for group in aggregate_groups:
+        if all(column in rows.columns for column in group):
+            apply(state['counts'].setdefault(group, {}), rows.groupby(list(group), observed=True).size())
+
+# Build the derived data, filter options and count aggregates from scratch
+def build_state(source, raw, key):
+    state = {'key': key, 'source': source, 'raw': raw, 'df': derive_rows(raw), 'options': {}, 'counts': {}}
+    update_counts(state, state['df'], 1)
+    return state
+
+# Return a new state patched with the rows inserted, deleted or changed since the previous read.
+# The given state is never modified, so sessions still reading it are unaffected, and
+# nothing is committed unless every step of the patch succeeds.
+def apply_deltas(state, source, raw):
+    old_raw = state['raw']
+    inserted = raw.index.difference(old_raw.index)
+    deleted = old_raw.index.difference(raw.index)
+    common = raw.index.intersection(old_raw.index)
+
+    old_common, new_common = old_raw.loc[common], raw.loc[common]
+    differs = (old_common != new_common) & ~(old_common.isna() & new_common.isna())
+    changed = common[differs.to_numpy().any(axis=1)]
+
+    patched = dict(state, source=source, raw=raw)
+    if len(inserted) == 0 and len(deleted) == 0 and len(changed) == 0:
+        return patched
+
+    removed = deleted.append(changed)
+    added = derive_rows(raw.loc[inserted.append(changed)])
+
+    patched['options'] = {column: dict(counter) for column, counter in state['options'].items()}
+    patched['counts'] = {group: dict(counter) for group, counter in state['counts'].items()}
+    update_counts(patched, state['df'].loc[removed], -1)
+    update_counts(patched, added, 1)
+
+    remaining = state['df'].drop(removed)
+    patched['df'] = pd.concat([remaining, added]) if len(added) else remaining
+    return patched
+
+# Return the state brought up to date with a new read of the sheet.
+# An unchanged read is detected by identity and costs nothing; without a key, or when
+# the sheet's columns change, everything is rebuilt.
+def refresh(state, source, key, rebuild=False):
+    if not rebuild and state is not None and state['source'] is source:
+        return state
+
+    raw = source.set_index(key) if key is not None else source
+    if (rebuild or key is None or state is None or state['key'] != key
+            or not raw.columns.equals(state['raw'].columns)):
+        return build_state(source, raw, key)
+
+    return apply_deltas(state, source, raw)
+
+# Whether two states hold the same derived data, filter options and count aggregates
+def states_match(state, other):
+    if state['options'] != other['options'] or state['counts'] != other['counts']:
+        return False
+    try:
+        pd.testing.assert_frame_equal(state['df'].sort_index(), other['df'].sort_index(), check_dtype=False)
+    except AssertionError:
+        return False
+    return True
+
+# Sorted filter options for a column
+def sorted_options(state, column):
+    return sorted(state['options'].get(column, {}), key=str)
+
+# Employee counts grouped by the given columns, from the maintained aggregates
+def aggregate_counts(state, by):
+    counts = state['counts'].get(tuple(by))
+    if not counts:
+        return None
+    if len(by) > 1:
+        index = pd.MultiIndex.from_tuples(list(counts), names=by)
+    else:
+        index = pd.Index(list(counts), name=by[0])
+    return pd.Series(list(counts.values()), index=index, dtype=int).sort_index()
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from employee_data import aggregate_counts, find_employee_key, refresh, sorted_options, states_match
+
+
+def make_sheet():
+    return pd.DataFrame({
+        'Employee ID': [101, 102, 103, 104, 105],
+        'unit': ['Finance', 'Finance', 'HR', 'IT', 'IT'],
+        'subunit': ['Tax', 'Audit', 'Payroll', 'Infra', 'Apps'],
+        'layer': ['L1', np.nan, 'L2', 'L1', 'L3'],
+        'gender': ['Male', 'Female', 'Female', 'Male', 'Female'],
+        'generation': ['GEN X', 'GEN Y', 'GEN Z', 'GEN Y', 'BOOMERS'],
+        'Religious Denomination Key': ['Islam', 'Kristen', 'Islam', 'Hindu', 'Buddha'],
+        'Years': [0.5, 2.0, 5.0, 12.0, 30.0],
+        'region': ['Jakarta', 'Bandung', 'Jakarta', 'Surabaya', 'Bandung'],
+        'Age': [25, 31, 22, 40, 60],
+    })
+
+
+def assert_matches_rebuild(state, sheet):
+    rebuilt = refresh(None, sheet, 'Employee ID')
+    assert state['options'] == rebuilt['options']
+    assert state['counts'] == rebuilt['counts']
+    pd.testing.assert_frame_equal(state['df'].sort_index(), rebuilt['df'].sort_index(), check_dtype=False)
+
+
+def patched(new_sheet):
+    state = refresh(None, make_sheet(), 'Employee ID')
+    return refresh(state, new_sheet, 'Employee ID')
+
+
+def test_inserted_rows():
+    sheet = make_sheet()
+    new_row = sheet.iloc[[0]].assign(**{'Employee ID': 106, 'unit': 'Legal', 'Years': 3.0})
+    sheet = pd.concat([sheet, new_row], ignore_index=True)
+    state = patched(sheet)
+    assert state['options']['unit']['Legal'] == 1
+    assert_matches_rebuild(state, sheet)
+
+
+def test_deleted_rows():
+    sheet = make_sheet()
+    sheet = sheet[sheet['unit'] != 'HR']
+    state = patched(sheet)
+    assert 'HR' not in state['options']['unit']
+    assert_matches_rebuild(state, sheet)
+
+
+def test_changed_rows():
+    sheet = make_sheet()
+    sheet.loc[sheet['Employee ID'] == 102, 'unit'] = 'HR'
+    sheet.loc[sheet['Employee ID'] == 104, 'gender'] = 'Female'
+    state = patched(sheet)
+    assert state['counts'][('unit',)] == {'Finance': 1, 'HR': 2, 'IT': 2}
+    assert_matches_rebuild(state, sheet)
+
+
+@pytest.mark.parametrize('employee, value', [(102, 'L2'), (101, np.nan)])
+def test_layer_changed_between_nan_and_value(employee, value):
+    sheet = make_sheet()
+    sheet.loc[sheet['Employee ID'] == employee, 'layer'] = value
+    state = patched(sheet)
+    assert_matches_rebuild(state, sheet)
+
+
+def test_years_changed_to_nan():
+    sheet = make_sheet()
+    sheet.loc[sheet['Employee ID'] == 103, 'Years'] = np.nan
+    state = patched(sheet)
+    assert_matches_rebuild(state, sheet)
+
+
+def test_change_crossing_tenure_bin_boundary():
+    sheet = make_sheet()
+    sheet.loc[sheet['Employee ID'] == 101, 'Years'] = 1.0
+    state = patched(sheet)
+    assert state['df'].loc[101, 'Service_Group'] == '1-3 Year'
+    assert ('Finance', '<1 Year') not in state['counts'][('unit', 'Service_Group')]
+    assert_matches_rebuild(state, sheet)
+
+
+def test_unchanged_read_is_not_diffed():
+    sheet = make_sheet()
+    state = refresh(None, sheet, 'Employee ID')
+    raw = state['raw']
+    assert refresh(state, sheet, 'Employee ID') is state
+    assert state['raw'] is raw
+
+
+def test_missing_key_rebuilds():
+    sheet = make_sheet()
+    assert find_employee_key(sheet, 'NIK') is None
+    assert find_employee_key(sheet.assign(**{'Employee ID': 1}), 'Employee ID') is None
+    state = refresh(None, sheet, None)
+    sheet = sheet[sheet['unit'] != 'HR']
+    state = refresh(state, sheet, None)
+    assert 'HR' not in state['options']['unit']
+
+
+def test_options_and_aggregates_are_sorted():
+    sheet = make_sheet()
+    state = refresh(None, sheet, 'Employee ID')
+    sheet = sheet[sheet['unit'] != 'Finance']
+    state = refresh(state, sheet, 'Employee ID')
+    sheet = pd.concat([sheet, make_sheet().iloc[[0]]], ignore_index=True)
+    state = refresh(state, sheet, 'Employee ID')
+    assert sorted_options(state, 'unit') == ['Finance', 'HR', 'IT']
+    counts = aggregate_counts(state, ['unit'])
+    expected = sheet.groupby(['unit'], observed=True).size()
+    pd.testing.assert_series_equal(counts, expected, check_dtype=False)
+
+
+def test_failed_patch_leaves_state_unchanged():
+    sheet = make_sheet()
+    state = refresh(None, sheet, 'Employee ID')
+    bad_sheet = sheet.astype({'Years': object})
+    bad_sheet.loc[bad_sheet['Employee ID'] == 102, ['unit', 'Years']] = ['HR', 'n/a']
+    with pytest.raises(TypeError):
+        refresh(state, bad_sheet, 'Employee ID')
+    # A later read of the same sheet retries the patch instead of finding nothing to do
+    with pytest.raises(TypeError):
+        refresh(state, bad_sheet.copy(), 'Employee ID')
+    assert state['source'] is sheet
+    assert state['counts'][('unit',)] == {'Finance': 2, 'HR': 1, 'IT': 2}
+
+    fixed_sheet = bad_sheet.copy()
+    fixed_sheet.loc[fixed_sheet['Employee ID'] == 102, 'Years'] = 2.0
+    state = refresh(state, fixed_sheet, 'Employee ID')
+    assert state['counts'][('unit',)] == {'Finance': 1, 'HR': 2, 'IT': 2}
+    assert_matches_rebuild(state, fixed_sheet)
+
+
+def test_patch_does_not_modify_previous_state():
+    sheet = make_sheet()
+    state = refresh(None, sheet, 'Employee ID')
+    options = {column: dict(counter) for column, counter in state['options'].items()}
+    counts = {group: dict(counter) for group, counter in state['counts'].items()}
+    df = state['df'].copy()
+
+    new_sheet = sheet[sheet['unit'] != 'HR']
+    patched_state = refresh(state, new_sheet, 'Employee ID')
+    assert patched_state is not state
+    assert state['options'] == options
+    assert state['counts'] == counts
+    pd.testing.assert_frame_equal(state['df'], df)
+    assert_matches_rebuild(patched_state, new_sheet)
+
+
+def test_states_match_compares_derived_data():
+    sheet = make_sheet()
+    state = refresh(None, sheet, 'Employee ID')
+    rebuilt = refresh(state, sheet, 'Employee ID', rebuild=True)
+    assert states_match(state, rebuilt)
+
+    drifted = dict(state, df=state['df'].assign(region='Jakarta'))
+    assert not states_match(drifted, rebuilt)